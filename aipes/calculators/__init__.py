@@ -1,4 +1,6 @@
 """
+Derived and wrapper calculator classes.
+
 If forces are to be included in the objection function, be sure to use force-
 consistent energies instead of the energies extrapolated to 0 Kelvin. However,
 not all the calculators return force-consistent energies directly. This module
@@ -9,4 +11,6 @@ Available modules
 -----------------
 vasp:
     Derived VASP calculator.
+shared:
+    Calculator sharing one underlying calculator among multiple images.
 """
@@ -0,0 +1,38 @@
+"""
+Calculator class sharing one underlying calculator among multiple images.
+"""
+
+from ase.calculators.calculator import Calculator, all_changes
+
+
+class SharedCalculator(Calculator):
+    """
+    Calculator which forwards the calculations to a shared calculator.
+
+    ASE stores energies and forces in the calculator, not in atoms, so a
+    calculator cannot be attached to more than one image directly. This class
+    keeps the results separately for each image while the expensive parts,
+    e.g. the parameters and descriptor of an Amp calculator, are loaded only
+    once and held by the shared calculator.
+
+    Parameters
+    ----------
+    calc: 'Calculator' object
+        The shared calculator which performs the actual calculations.
+    """
+
+    implemented_properties = ["energy", "forces"]
+
+    def __init__(self, calc, **kwargs):
+        Calculator.__init__(self, **kwargs)
+        self.calc = calc
+
+    def calculate(self, atoms=None, properties=["energy"],
+                  system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+        # The shared calculator may hold the results of another image, so we
+        # clear them and always treat the atoms as changed.
+        self.calc.results = {}
+        self.calc.calculate(self.atoms, properties, all_changes)
+        for name in properties:
+            self.results[name] = self.calc.results[name]
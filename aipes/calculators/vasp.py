@@ -6,6 +6,11 @@ from ase.calculators.vasp import Vasp
 
 
 class VaspFC(Vasp):
+    """VASP calculator which always returns force-consistent energy."""
+
     def get_potential_energy(self, atoms, force_consistent=False):
+        # The update procedure of the base class checks the positions, atomic
+        # numbers, magnetic moments and convergence, and reruns VASP only if
+        # any of them requires it.
         self.update(atoms)
         return self.energy_free
@@ -8,6 +8,9 @@ validate _energy:
     Calculate RMSE and MaxResid for Amp energies against reference data.
 validate_forces:
     Calculate RMSE and MaxResid for Amp forces against reference data.
+validate_energy_forces:
+    Calculate RMSE and MaxResid for both Amp energies and forces against
+    reference data in a single pass.
 benchmark:
     Benchmark the model parameters via cross-validation.
 
@@ -28,12 +31,32 @@ use the derived calculators in aipes/calculators package with overridden
 'get_potential_energy()' method.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
-from .utilities import calc_mod, calc_rmse, calc_maxresid, echo
+from .utilities import calc_rmse, calc_maxresid, echo
+
+
+def _collect_ref(ref_data):
+    """
+    Collect reference energies and forces from ref_data.
+
+    Returns
+    -------
+    energies_ref: (N_images,) ndarray
+        Reference energies of the images.
+    forces_ref: list of (N_atoms, 3) ndarray
+        Reference forces of the images.
+    """
+    energies_ref = np.array([image.get_potential_energy(apply_constraint=False)
+                             for image in ref_data])
+    forces_ref = [image.get_forces(apply_constraint=False)
+                  for image in ref_data]
+    return energies_ref, forces_ref
 
 
-def validate_energy(calc_amp, ref_data):
+def validate_energy(calc_amp, ref_data, energies_ref=None):
     """
     Calculate RMSE and MaxResid for Amp energies against reference data.
 
@@ -44,6 +67,9 @@ def validate_energy(calc_amp, ref_data):
     ref_data:
         Reference data to validate the Amp calculator, typically from first
         principles calculations.
+    energies_ref: (N_images,) ndarray
+        Reference energies of ref_data, e.g. from _collect_ref. Extracted from
+        ref_data if not specified.
 
     Returns
     -------
@@ -52,19 +78,18 @@ def validate_energy(calc_amp, ref_data):
         RMSE and maximum residual between the energies predicted by Amp
         calculator and reference data, divided by the number of atoms.
     """
-    delta_energy = []
-    for image in ref_data:
-        energy_ref = image.get_potential_energy(apply_constraint=False)
-        energy_amp = calc_amp.get_potential_energy(image)
-        delta_energy.append(energy_ref - energy_amp)
-    delta_energy = np.array(delta_energy)
+    if energies_ref is None:
+        energies_ref = [image.get_potential_energy(apply_constraint=False)
+                        for image in ref_data]
+    energies_amp = [calc_amp.get_potential_energy(image) for image in ref_data]
+    delta_energy = np.array(energies_ref) - np.array(energies_amp)
     num_atom = len(ref_data[0])
     energy_rmse = calc_rmse(delta_energy) / num_atom
     energy_maxresid = calc_maxresid(delta_energy) / num_atom
     return energy_rmse, energy_maxresid
 
 
-def validate_forces(calc_amp, ref_data):
+def validate_forces(calc_amp, ref_data, forces_ref=None):
     """
     Calculate RMSE and MaxResid for Amp forces against reference data.
 
@@ -75,6 +100,9 @@ def validate_forces(calc_amp, ref_data):
     ref_data:
         Reference data to validate the Amp calculator, typically from first
         principles calculations.
+    forces_ref: list of (N_atoms, 3) ndarray
+        Reference forces of ref_data, e.g. from _collect_ref. Extracted from
+        ref_data if not specified.
 
     Returns
     -------
@@ -83,31 +111,115 @@ def validate_forces(calc_amp, ref_data):
         RMSE and maximum residual between the forces predicted by Amp
         calculator and reference data, divided by (3 * the number of atoms).
     """
-    delta_forces_mod = []
+    if forces_ref is None:
+        forces_ref = [image.get_forces(apply_constraint=False)
+                      for image in ref_data]
+    # The RMSE of the moduli of force residuals divided by sqrt(3) equals the
+    # RMSE of the force components, so we accumulate the sum of squares of the
+    # components directly.
+    sum_squares = 0.0
+    num_component = 0
     force_maxresid = 0.0
-    for image in ref_data:
-        forces_ref = image.get_forces(apply_constraint=False)
-        forces_amp = calc_amp.get_forces(image)
-        delta_forces = forces_ref - forces_amp
-        delta_forces_mod.extend([calc_mod(v) for v in delta_forces])
-        force_maxresid = np.fmax(force_maxresid, np.max(np.fabs(delta_forces)))
-    delta_forces_mod = np.array(delta_forces_mod)
-    force_rmse = calc_rmse(delta_forces_mod) / np.sqrt(3)
+    for image, forces in zip(ref_data, forces_ref):
+        delta_forces = np.ravel(forces - calc_amp.get_forces(image))
+        sum_squares += float(np.dot(delta_forces, delta_forces))
+        num_component += delta_forces.size
+        force_maxresid = max(force_maxresid, calc_maxresid(delta_forces))
+    force_rmse = np.sqrt(sum_squares / num_component)
     return force_rmse, force_maxresid
 
 
-def benchmark(gen_calc_amp, hidden_layers, dataset):
+def validate_energy_forces(calc_amp, ref_data):
+    """
+    Calculate RMSE and MaxResid for both Amp energies and forces against
+    reference data.
+
+    This function is equivalent to calling validate_energy and validate_forces
+    successively, except that the reference data are collected only once and
+    the Amp calculator is queried for both quantities image by image.
+
+    Parameters
+    ----------
+    calc_amp: 'Amp' object
+        Amp calculator to be validated.
+    ref_data:
+        Reference data to validate the Amp calculator, typically from first
+        principles calculations.
+
+    Returns
+    -------
+    energy_rmse: float
+    energy_maxresid: float
+    force_rmse: float
+    force_maxresid: float
+        Same as the returned values of validate_energy and validate_forces.
+    """
+    energies_ref, forces_ref = _collect_ref(ref_data)
+    energies_amp = np.empty(len(ref_data))
+    sum_squares = 0.0
+    num_component = 0
+    force_maxresid = 0.0
+    for index, (image, forces) in enumerate(zip(ref_data, forces_ref)):
+        energies_amp[index] = calc_amp.get_potential_energy(image)
+        delta_forces = np.ravel(forces - calc_amp.get_forces(image))
+        sum_squares += float(np.dot(delta_forces, delta_forces))
+        num_component += delta_forces.size
+        force_maxresid = max(force_maxresid, calc_maxresid(delta_forces))
+    delta_energy = energies_ref - energies_amp
+    num_atom = len(ref_data[0])
+    energy_rmse = calc_rmse(delta_energy) / num_atom
+    energy_maxresid = calc_maxresid(delta_energy) / num_atom
+    force_rmse = np.sqrt(sum_squares / num_component)
+    return energy_rmse, energy_maxresid, force_rmse, force_maxresid
+
+
+def _run_fold(gen_calc_amp, hidden_layers, dataset, igroup, concurrent=False):
+    """
+    Train an Amp calculator on one fold of the dataset and validate it.
+
+    If concurrent is True, the id of the subgroup is passed to gen_calc_amp as
+    the second argument, so that the folds running at the same time do not
+    share any files.
+
+    Returns
+    -------
+    accuracy_train: list
+    accuracy_valid: list
+        Energy_rmse, energy_maxresid, force_rmse and force_maxresid of the
+        training and validation datasets.
+    """
+    # Instantiate an Amp calculator
+    if concurrent is True:
+        calc_amp = gen_calc_amp(hidden_layers, igroup)
+    else:
+        calc_amp = gen_calc_amp(hidden_layers)
+
+    # Train the calculator
+    train_set, valid_set = dataset.select(igroup)
+    calc_amp.train(images=train_set, overwrite=True)
+
+    # Validate the calculator
+    accuracy_train = list(validate_energy_forces(calc_amp, train_set))
+    accuracy_valid = list(validate_energy_forces(calc_amp, valid_set))
+    return accuracy_train, accuracy_valid
+
+
+def benchmark(gen_calc_amp, hidden_layers, dataset, num_proc=1):
     """
     Benchmark the model parameters via cross-validation.
 
     Parameters
     ----------
     gen_calc_amp: function object
-        Function that instantiates an 'Amp' object.
+        Function that instantiates an 'Amp' object, with the topology of the
+        neural network as argument. If num_proc > 1, the id of the subgroup is
+        passed as the second argument.
     hidden_layers: list or tuple
         Topology of the artificial neural network.
     dataset: 'Dataset' object
         Grouped dataset for cross-validation.
+    num_proc: integer
+        Number of processes to run the cross-validation folds concurrently.
 
     Returns
     -------
@@ -116,29 +228,25 @@ def benchmark(gen_calc_amp, hidden_layers, dataset):
     Notes
     -----
     Dataset should be grouped before calling this function.
+
+    The folds are independent of each other. If num_proc > 1, they are trained
+    in separate processes, so gen_calc_amp must produce a unique label and
+    dblabel for each subgroup. Otherwise the Amp calculators will overwrite the
+    files of each other.
     """
     # Run cross validation to determine the average RMSE and MaxResid
     # for energies and forces for training and validation dataset
-    accuracy_train = []
-    accuracy_valid = []
-    for igroup in range(dataset.ngroup):
-        # Instantiate an Amp calculator
-        calc_amp = gen_calc_amp(hidden_layers)
-
-        # Train the calculator
-        train_set, valid_set = dataset.select(igroup)
-        calc_amp.train(images=train_set, overwrite=True)
-
-        # Validate the calculator
-        energy_rmse, energy_maxresid = validate_energy(calc_amp, train_set)
-        force_rmse, force_maxresid = validate_forces(calc_amp, train_set)
-        accuracy_train.append([energy_rmse, energy_maxresid, force_rmse,
-                               force_maxresid])
-
-        energy_rmse, energy_maxresid = validate_energy(calc_amp, valid_set)
-        force_rmse, force_maxresid = validate_forces(calc_amp, valid_set)
-        accuracy_valid.append([energy_rmse, energy_maxresid, force_rmse,
-                               force_maxresid])
+    if num_proc > 1:
+        with ProcessPoolExecutor(max_workers=num_proc) as executor:
+            futures = [executor.submit(_run_fold, gen_calc_amp, hidden_layers,
+                                       dataset, igroup, True)
+                       for igroup in range(dataset.ngroup)]
+            results = [future.result() for future in futures]
+    else:
+        results = [_run_fold(gen_calc_amp, hidden_layers, dataset, igroup)
+                   for igroup in range(dataset.ngroup)]
+    accuracy_train = [result[0] for result in results]
+    accuracy_valid = [result[1] for result in results]
 
     # echo
     accuracy_train = np.array(accuracy_train)
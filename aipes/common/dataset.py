@@ -8,10 +8,12 @@ Dataset:
     resampling techniques.
 """
 
-from copy import deepcopy
-from random import shuffle, randint
+from itertools import chain
+from random import shuffle
 
-from ase.io import read
+import numpy as np
+
+from ase.io import iread
 
 
 class Dataset(object):
@@ -60,7 +62,7 @@ class Dataset(object):
         if self.rawdata is not None:
             print("You are reloading a dataset. Regroup it before cross "
                   "validation.")
-        self.rawdata = read(trajname, index=":")
+        self.rawdata = list(iread(trajname))
 
     def group(self, ngroup=1, rand=True):
         """Group rawdata into subgroups for cross validation.
@@ -70,8 +72,7 @@ class Dataset(object):
         ngroup: integer
             Number of subgroups.
         rand: boolean
-            Determines whether to shuffle rawdata (in fact a copy) before
-            grouping.
+            Determines whether to shuffle rawdata before grouping.
 
         Returns
         -------
@@ -79,13 +80,13 @@ class Dataset(object):
         """
         if self.rawdata is None:
             raise IOError("Trajectory file not loaded!")
+        # Shuffle the indices instead of the data so that no copy of the
+        # images is made.
+        indices = list(range(len(self.rawdata)))
         if rand is True:
-            worklist = deepcopy(self.rawdata)
-            shuffle(worklist)
-        else:
-            worklist = self.rawdata
-        self.grouped_data = [[worklist[j] for j in range(len(worklist))
-                              if j % ngroup == i] for i in range(ngroup)]
+            shuffle(indices)
+        self.grouped_data = [[self.rawdata[j] for j in indices[i::ngroup]]
+                             for i in range(ngroup)]
         self.ngroup = ngroup
 
     def select(self, igroup=0):
@@ -110,8 +111,8 @@ class Dataset(object):
         if self.grouped_data is None:
             raise RuntimeError("Group the dataset before cross validation!")
         valid_set = self.grouped_data[igroup]
-        train_set = [data for group in self.grouped_data for data in group
-                     if group is not valid_set]
+        train_set = list(chain.from_iterable(
+            group for i, group in enumerate(self.grouped_data) if i != igroup))
         return train_set, valid_set
 
     def select_bootstrap(self, num_sample=1):
@@ -130,6 +131,6 @@ class Dataset(object):
         if self.rawdata is None:
             raise IOError("Trajectory file not loaded!")
         ndata = len(self.rawdata)
-        sampling_set = [[self.rawdata[randint(0, ndata - 1)]
-                         for j in range(ndata)] for i in range(num_sample)]
+        indices = np.random.randint(0, ndata, size=(num_sample, ndata))
+        sampling_set = [[self.rawdata[j] for j in row] for row in indices]
         return sampling_set
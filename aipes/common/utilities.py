@@ -1,27 +1,81 @@
 """Mathematical and I/O functions."""
 
-import sys
+import hashlib
 
 import numpy as np
 
+from ase.io import read
+from ase.io.trajectory import Trajectory
+
 
 def calc_rmse(dx):
     """Calculate root-mean-square error from dx = x_predict - x_exact."""
-    return np.sqrt(np.sum(dx**2) / dx.size)
+    dx = np.ravel(dx)
+    return float(np.sqrt(np.dot(dx, dx) / dx.size))
 
 
 def calc_maxresid(dx):
     """Calculate maximum residual from dx = x_predict - x_exact."""
-    return np.max(np.fabs(dx))
+    return float(max(np.max(dx), -np.min(dx)))
 
 
 def calc_mod(x):
     """Calculate modulus for vector x."""
-    return np.sqrt(np.sum(x**2))
+    x = np.ravel(x)
+    return np.sqrt(np.dot(x, x))
+
+
+def hash_images(images):
+    """
+    Calculate a digest of the atoms, positions, energies and forces of images.
+
+    The digest is used to check whether a dataset has changed, e.g. to skip
+    the re-training of an Amp calculator on the same training dataset.
+    """
+    # SHA-1 is used for change detection only, not for security, and is
+    # available in all the supported Python versions.
+    digest = hashlib.sha1()
+    for image in images:
+        digest.update(image.get_atomic_numbers().tobytes())
+        digest.update(image.get_positions().tobytes())
+        energy = image.get_potential_energy(apply_constraint=False)
+        digest.update(np.float64(energy).tobytes())
+        digest.update(image.get_forces(apply_constraint=False).tobytes())
+    return digest.hexdigest()
 
 
 def echo(text="", rank=0, **kwargs):
     """Print text and flush on master node."""
-    if rank == 0:
-        print(text, **kwargs)
-        sys.stdout.flush()
+    if rank != 0:
+        return
+    print(text, flush=True, **kwargs)
+
+
+def read_traj(filename, index=":"):
+    """
+    Read images from a trajectory file.
+
+    Parameters
+    ----------
+    filename: string
+        Name of the trajectory file.
+    index: integer or string
+        Index of the image to read, or ":" for all the images.
+
+    Returns
+    -------
+    images: 'Atoms' object or list of 'Atoms' objects
+        The image at index, or all the images if index is ":".
+
+    Notes
+    -----
+    Files with the '.traj' extension are read with the Trajectory reader of ASE
+    directly, bypassing the format detection and dispatching of ase.io.read.
+    Other formats are passed to ase.io.read with parallel=False.
+    """
+    if not filename.endswith(".traj"):
+        return read(filename, index=index, parallel=False)
+    with Trajectory(filename, "r") as traj:
+        if index == ":":
+            return [image for image in traj]
+        return traj[index]
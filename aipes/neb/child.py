@@ -3,14 +3,15 @@ Script to start child process for NEB calculation, called by the 'dynamic'
 module.
 """
 
-from mpi4py import MPI
+from io import StringIO
+
+import numpy as np
 
-from ase.neb import NEB
-from ase.optimize import BFGS, FIRE
+from mpi4py import MPI
 
 from amp import Amp
 
-from ..common.utilities import echo
+from .common import build_images, run_neb
 
 
 # Initialize MPI environment
@@ -20,42 +21,40 @@ rank_parent = comm_parent.Get_rank()
 rank_world = comm_world.Get_rank()
 assert rank_parent == rank_world
 
-# Fetch data from parent process
-neb_args = comm_parent.bcast(None, root=0)
-mep = comm_parent.bcast(None, root=0)
-label = comm_parent.bcast(None, root=0)
-
-# Assign calculator to the active image
-calc_amp = Amp.load(label+".amp", cores=1, label=label, logging=False)
-mep[rank_world+1].set_calculator(calc_amp)
-
-# Run NEB
-assert (len(neb_args["climb"]) ==
-        len(neb_args["opt_algorithm"]) ==
-        len(neb_args["fmax"]) ==
-        len(neb_args["steps"]))
-for stage in range(len(neb_args["climb"])):
-    if neb_args["climb"][stage] is False:
-        echo("Climbing image switched off.", rank_world)
-    else:
-        echo("Climbing image switched on.", rank_world)
-    neb_runner = NEB(mep,
-                     k=neb_args["k"],
-                     climb=neb_args["climb"][stage],
-                     remove_rotation_and_translation=
-                     neb_args["rm_rot_trans"],
-                     method=neb_args["method"],
-                     parallel=True)
-    # NOTE: interpolation is done in initialize_mep.
-    if neb_args["opt_algorithm"][stage] == "FIRE":
-        opt_algorithm = FIRE
-    else:
-        opt_algorithm = BFGS
-    opt_runner = opt_algorithm(neb_runner)
-    opt_runner.run(fmax=neb_args["fmax"][stage],
-                   steps=neb_args["steps"][stage])
-
-# Send MEP back to parent process
-active_image = mep[rank_world+1].copy()
-comm_parent.gather(active_image, root=0)
+# The child processes are spawned only once and kept alive during the whole
+# AI-NEB calculation. Each command from the parent process is either "neb",
+# which runs one NEB calculation, or "exit", which terminates the loop.
+while True:
+    command, data = comm_parent.bcast(None, root=0)
+    if command == "exit":
+        break
+
+    # Fetch data from parent process
+    # The initial and final images are pickled while the intermediate images
+    # are rebuilt from the positions received via buffer-based Bcast.
+    neb_args, initial_image, final_image, label, calc_size = data
+    calc_bytes = np.empty(calc_size, dtype=np.uint8)
+    comm_parent.Bcast([calc_bytes, MPI.BYTE], root=0)
+    num_inter_images = comm_world.Get_size()
+    positions = np.empty((num_inter_images, len(initial_image), 3))
+    comm_parent.Bcast([positions, MPI.DOUBLE], root=0)
+    mep = [initial_image]
+    mep.extend(build_images(initial_image, positions))
+    mep.append(final_image)
+
+    # Assign calculator to the active image
+    # The parameters of the calculator are read from disk once by the parent
+    # process and broadcast as raw bytes, so we load it from memory.
+    calc_text = calc_bytes.tobytes().decode()
+    calc_amp = Amp.load(StringIO(calc_text), cores=1, label=label,
+                        logging=False)
+    mep[rank_world+1].set_calculator(calc_amp)
+
+    # Run NEB
+    run_neb(mep, neb_args, parallel=True, rank=rank_world)
+
+    # Send MEP back to parent process
+    active_positions = np.ascontiguousarray(mep[rank_world+1].get_positions())
+    comm_parent.Gather([active_positions, MPI.DOUBLE], None, root=0)
+
 comm_parent.Disconnect()
@@ -5,37 +5,184 @@ Available functions
 -------------------
 initialize_mep:
     Build the initial minimum energy path (MEP) from initial and final images.
+build_images:
+    Build images from a template image and an array of atomic positions.
+run_neb:
+    Relax the MEP with the NEB method stage by stage.
 validate_mep:
     Check the difference between energies/forces produced by Amp and first
     principles calculators for images along the MEP to determine if convergence
     has been reached.
+check_convergence:
+    Print the accuracy and check if convergence has been reached.
 cluster_data:
     Cluster the full data into training and remaining datasets in order to avoid
     fitting problems.
+train_calc_amp:
+    Instantiate the Amp calculator and train it on the training dataset.
+open_train_traj:
+    Open train.traj for saving the training dataset incrementally.
 """
 
+import os
+import shutil
 import time
 
 import numpy as np
 
 from ase.neb import NEB
+from ase.optimize import BFGS, FIRE, LBFGS
+from ase.io.trajectory import Trajectory
+from ase.calculators.singlepoint import SinglePointCalculator
 
-from ..common.utilities import echo
-from ..common.benchmark import validate_energy, validate_forces
+from amp.utilities import Annealer
 
+from ..common.utilities import echo, hash_images
+from ..common.benchmark import validate_energy_forces
+
+
+# Optimizers available for NEB calculations, keyed by the names used in
+# neb_args["opt_algorithm"]. Unknown names fall back to BFGS. The optimizers
+# act on the positions of all the intermediate images as one vector, so LBFGS
+# is the global L-BFGS of the whole band rather than one per image.
+OPT_ALGORITHMS = {"FIRE": FIRE, "BFGS": BFGS, "LBFGS": LBFGS}
+
+# Directory where the trained Amp calculators are cached by train_calc_amp.
+AMP_CACHE_DIR = "amp-cache"
+
+# Keys of the accuracy dictionary returned by validate_mep, in the order of
+# the values returned by validate_energy_forces.
+ACCURACY_KEYS = ("energy_rmse", "energy_maxresid", "force_rmse",
+                 "force_maxresid")
+
+
+def initialize_mep(initial_image, final_image, num_inter_images, neb_args,
+                   cache=None):
+    """
+    Build the MEP from initial and final images.
+
+    Parameters
+    ----------
+    initial_image, final_image: 'Atoms' objects
+        End points of the MEP.
+    num_inter_images: integer
+        Number of intermediate images.
+    neb_args: dictionary
+        Arguments of the NEB calculation, of which "interp" and "mic" are used
+        for the interpolation.
+    cache: dictionary
+        If specified, the interpolated intermediate images are cached in this
+        dictionary and copied by subsequent calls with the same interpolation
+        arguments. In that case the end points MUST stay the same between the
+        calls.
+
+    Returns
+    -------
+    mep: list of 'Atoms' objects
+        Initial guess of the MEP, including the end points.
+    """
+    key = (num_inter_images, neb_args["interp"], neb_args["mic"])
+    if cache is not None and key in cache:
+        inter_images = [image.copy() for image in cache[key]]
+        return [initial_image] + inter_images + [final_image]
 
-def initialize_mep(initial_image, final_image, num_inter_images, neb_args):
-    """Build the MEP from initial and final images."""
     mep = [initial_image]
     for i in range(num_inter_images):
         mep.append(initial_image.copy())
     mep.append(final_image)
     neb_runner = NEB(mep)
     neb_runner.interpolate(method=neb_args["interp"], mic=neb_args["mic"])
+    # The cached images are copies, as the MEP is optimized in place.
+    if cache is not None:
+        cache[key] = [image.copy() for image in mep[1:-1]]
     return mep
 
 
-def validate_mep(mep, calc_amp, gen_calc_ref):
+def build_images(template, positions):
+    """
+    Build images from a template image and an array of atomic positions.
+
+    Parameters
+    ----------
+    template: 'Atoms' object
+        Image providing the atomic numbers, cell, pbc and constraints.
+    positions: (num_images, num_atoms, 3) array
+        Atomic positions of the images.
+
+    Returns
+    -------
+    images: list of 'Atoms' objects
+        Copies of template with the positions replaced, without applying the
+        constraints of template. No calculators are attached.
+
+    Notes
+    -----
+    This function is used together with the buffer-based MPI collectives
+    (Bcast/Gather), which transfer only the positions along the MEP instead of
+    pickling the whole 'Atoms' objects.
+    """
+    images = []
+    for image_positions in positions:
+        image = template.copy()
+        # The positions are transferred as they are, since applying the
+        # constraints of the template would alter them.
+        image.set_positions(image_positions, apply_constraint=False)
+        images.append(image)
+    return images
+
+
+def run_neb(mep, neb_args, parallel=False, rank=0):
+    """
+    Relax the MEP with the NEB method stage by stage.
+
+    Parameters
+    ----------
+    mep: list of 'Atoms' objects
+        Images along the MEP, with calculators attached to the intermediate
+        images. The positions are updated in place.
+    neb_args: dictionary
+        Arguments of the NEB calculation. The lists "climb", "opt_algorithm",
+        "fmax" and "steps" must have the same length, one entry per stage.
+    parallel: boolean
+        Whether to run NEB in parallel, with each process handling one image.
+    rank: integer
+        Rank of the calling process. Only the master process prints.
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    The same NEB object is reused for all the stages, with only the climbing
+    image switched on or off, so that the band is set up only once.
+    """
+    assert (len(neb_args["climb"]) ==
+            len(neb_args["opt_algorithm"]) ==
+            len(neb_args["fmax"]) ==
+            len(neb_args["steps"]))
+    opt_algorithms = [OPT_ALGORITHMS.get(name, BFGS)
+                      for name in neb_args["opt_algorithm"]]
+    # NOTE: interpolation is done in initialize_mep.
+    neb_runner = NEB(mep,
+                     k=neb_args["k"],
+                     climb=neb_args["climb"][0],
+                     remove_rotation_and_translation=neb_args["rm_rot_trans"],
+                     method=neb_args["method"],
+                     parallel=parallel)
+    for stage, opt_algorithm in enumerate(opt_algorithms):
+        if neb_args["climb"][stage] is False:
+            echo("Climbing image switched off.", rank)
+        else:
+            echo("Climbing image switched on.", rank)
+        neb_runner.climb = neb_args["climb"][stage]
+        opt_runner = opt_algorithm(neb_runner)
+        opt_runner.run(fmax=neb_args["fmax"][stage],
+                       steps=neb_args["steps"][stage])
+
+
+def validate_mep(mep, calc_amp, gen_calc_ref, comm=None, traj=None,
+                 reuse_calc_ref=False):
     """
     Check MEP against reference calculator.
 
@@ -48,6 +195,20 @@ def validate_mep(mep, calc_amp, gen_calc_ref):
         Amp calculator with which NEB calculation has been performed.
     gen_calc_ref: function object
         Function than instantiates a reference (first principles) calculator.
+    comm: MPI communicator
+        If specified, the images are distributed over the processes of comm and
+        the reference calculations are performed concurrently. In that case mep
+        and calc_amp are only required on the master process.
+    traj: 'Trajectory' object
+        If specified, the reference images are written to traj. Without comm
+        each image is written as soon as its reference calculation finishes,
+        so that the results survive a crash in the middle of the validation.
+        With comm the images are written by the master process after they
+        have been collected, and traj is only required on the master process.
+    reuse_calc_ref: boolean
+        If True, the reference calculator is instantiated once per process and
+        reset before each of the following images. Otherwise a new reference
+        calculator is instantiated for each image.
 
     Returns
     -------
@@ -58,66 +219,272 @@ def validate_mep(mep, calc_amp, gen_calc_ref):
     ref_images: list of 'Atoms' objects
         Accurate energies and forces along MEP to improve the training data set.
 
+    If comm is specified, both accuracy and ref_images are None on processes
+    other than the master process.
+
     CAUTION
     -------
-    We have to assign a separate reference calculator to each copy of the images
-    in MEP. This is due to the fact that ASE stores forces and energies in the
-    calculator, not in atoms. Sharing the same calculator among multiple images
-    will cause re-calculation and wastes time.
+    ASE stores forces and energies in the calculator, not in atoms. So the
+    results are stored in a SinglePointCalculator attached to each of the
+    reference images as soon as they have been calculated, which can be passed
+    across processes. This allows the reference calculator to be reused with
+    reuse_calc_ref=True, provided that its reset() method clears all the
+    results and state left by the previous image. This does not hold for all
+    file-based calculators, e.g. the legacy Vasp calculator keeps its
+    parameters and working files, so reuse is off by default.
 
     We shall not apply any constraints when comparing energies and forces from
     Amp calculator against the results from reference calculator.
-    """
-    ref_images = []
 
+    When running in parallel, the reference calculations of different processes
+    must not share the same working directory, e.g. for VASP. Only the master
+    process prints the progress, for the images assigned to it.
+    """
     # We assume that mep DOES NOT contain initial and final images, which is the
     # case for parallel version of run_aineb. For serial version, pass mep[1:-1]
     # instead of the whole mep to this function as the argument.
-    for index, image in enumerate(mep):
+    if comm is None:
+        rank = 0
+        local_images = list(enumerate(mep))
+    else:
+        rank, size = comm.Get_rank(), comm.Get_size()
+        if rank == 0:
+            indexed_images = list(enumerate(mep))
+            local_images = [indexed_images[i::size] for i in range(size)]
+        else:
+            local_images = None
+        local_images = comm.scatter(local_images, root=0)
+
+    ref_images = []
+    calc_ref = None
+    for index, image in local_images:
         t0 = time.strftime("%H:%M:%S")
-        echo("Dealing with image # %d at %s." % (index+1, t0))
+        echo("Dealing with image # %d at %s." % (index+1, t0), rank)
         image_copy = image.copy()
-        image_copy.set_calculator(gen_calc_ref())
+        if calc_ref is None or reuse_calc_ref is False:
+            calc_ref = gen_calc_ref()
+        else:
+            calc_ref.reset()
+        image_copy.set_calculator(calc_ref)
 
         # For the first few iterations NEB may produce unphysical intermediate
         # images, and the forces and energy calls are likely to fail. We have to
         # handle this exception here.
         try:
-            image_copy.get_forces(apply_constraint=False)
-            image_copy.get_potential_energy(apply_constraint=False)
+            forces = image_copy.get_forces(apply_constraint=False)
+            energy = image_copy.get_potential_energy(apply_constraint=False)
         except RuntimeError:
-            echo("ERROR: reference code exited abnormally.")
-            echo("Image discarded.")
+            echo("ERROR: reference code exited abnormally.", rank)
+            echo("Image discarded.", rank)
             pass
         except UnboundLocalError:
-            echo("ERROR: forces/energy evaluation failed.")
-            echo("Image discarded.")
+            echo("ERROR: forces/energy evaluation failed.", rank)
+            echo("Image discarded.", rank)
             pass
         else:
-            ref_images.append(image_copy)
+            # The forces are copied since the reference calculator is reused.
+            calc_single = SinglePointCalculator(image_copy, energy=energy,
+                                                forces=forces.copy())
+            image_copy.set_calculator(calc_single)
+            ref_images.append((index, image_copy))
+            if comm is None and traj is not None:
+                traj.write(image_copy)
+
+    # Collect the reference images on master process in the original order
+    if comm is not None:
+        ref_images = comm.gather(ref_images, root=0)
+        if rank != 0:
+            return None, None
+        ref_images = sorted([item for group in ref_images for item in group],
+                            key=lambda item: item[0])
+    ref_images = [item[1] for item in ref_images]
+    if comm is not None and traj is not None:
+        for image in ref_images:
+            traj.write(image)
 
     # Calculate RMSE and MaxResid
-    energy_rmse, energy_maxresid = validate_energy(calc_amp, ref_images)
-    force_rmse, force_maxresid = validate_forces(calc_amp, ref_images)
-    accuracy = {"energy_rmse": energy_rmse, "energy_maxresid": energy_maxresid,
-                "force_rmse": force_rmse, "force_maxresid": force_maxresid}
+    accuracy = dict(zip(ACCURACY_KEYS,
+                        validate_energy_forces(calc_amp, ref_images)))
 
     return accuracy, ref_images
 
 
-def cluster_data(full_set, dataset_args):
+def check_convergence(accuracy, convergence, rank=0):
+    """
+    Print the accuracy and check if convergence has been reached.
+
+    Parameters
+    ----------
+    accuracy: dictionary
+        Accuracy returned by validate_mep.
+    convergence: dictionary
+        Thresholds of the accuracy, with the same keys as accuracy.
+    rank: integer
+        Rank of the calling process. Only the master process prints.
+
+    Returns
+    -------
+    converged: boolean
+        True if all the entries of accuracy are below the thresholds.
+    """
+    accuracy_array = np.array([accuracy[key] for key in ACCURACY_KEYS])
+    convergence_array = np.array([convergence[key] for key in ACCURACY_KEYS])
+    for key, value, threshold in zip(ACCURACY_KEYS, accuracy_array,
+                                     convergence_array):
+        echo("%16s = %13.4e (%13.4e)" % (key, value, threshold), rank)
+    return bool(np.all(accuracy_array <= convergence_array))
+
+
+def cluster_data(full_set, dataset_args, stats=None):
     """
     Cluster the full data into training and remaining datasets in order to avoid
     fitting problems. Only the training dataset is returned.
+
+    Parameters
+    ----------
+    full_set: list of 'Atoms' objects
+        Full dataset to be clustered.
+    dataset_args: dictionary
+        Thresholds of maximum force and energy deviation from the mean energy.
+    stats: dictionary
+        If specified, the energies and maximum forces of the images are cached
+        in this dictionary and reused by subsequent calls. In that case
+        full_set MUST only grow by appending new images between the calls.
+
+    Returns
+    -------
+    train_set: list of 'Atoms' objects
+        Training dataset.
     """
-    mean_epot = np.array([image.get_potential_energy(apply_constraint=False)
-                          for image in full_set]).mean()
-    train_set = []
-    for image in full_set:
-        forces = image.get_forces(apply_constraint=False)
-        forces_mod = np.array([np.sqrt(np.sum(v**2)) for v in forces])
-        epot = image.get_potential_energy(apply_constraint=False)
-        if (np.max(forces_mod) <= dataset_args["image_fmax"] and
-           abs(epot-mean_epot) <= dataset_args["image_dE"]):
-            train_set.append(image)
+    if stats is None:
+        stats = {}
+    epots = stats.setdefault("epots", [])
+    fmaxs = stats.setdefault("fmaxs", [])
+    new_images = full_set[len(epots):]
+    if len(new_images) > 0:
+        epots.extend(image.get_potential_energy(apply_constraint=False)
+                     for image in new_images)
+        # The forces of all the new images are concatenated and reduced in one
+        # pass. np.maximum.reduceat handles images with different numbers of
+        # atoms.
+        forces = [image.get_forces(apply_constraint=False)
+                  for image in new_images]
+        offsets = np.cumsum([0] + [len(f) for f in forces[:-1]])
+        fnorms = np.linalg.norm(np.concatenate(forces), axis=1)
+        fmaxs.extend(np.maximum.reduceat(fnorms, offsets))
+
+    # The mean energy changes as the dataset grows, so the selection is always
+    # redone for all the images, but on the cached values.
+    epots_array = np.array(epots)
+    fmaxs_array = np.array(fmaxs)
+    selected = ((fmaxs_array <= dataset_args["image_fmax"]) &
+                (np.abs(epots_array - epots_array.mean()) <=
+                 dataset_args["image_dE"]))
+    train_set = [image for image, flag in zip(full_set, selected) if flag]
     return train_set
+
+
+def train_calc_amp(gen_calc_amp, train_set, iteration, control_args,
+                   last_train_hash=None):
+    """
+    Instantiate the Amp calculator and train it on the training dataset.
+
+    Parameters
+    ----------
+    gen_calc_amp: function object
+        Function that instantiates an Amp calculator.
+    train_set: list of 'Atoms' objects
+        Training dataset.
+    iteration: integer
+        Index of the current iteration of run_aineb, starting from 0.
+    control_args: dictionary
+        Controlling arguments, determining whether the calculator is reloaded
+        from previous training, whether annealing is performed and whether the
+        trained calculators are cached on disk ('cache_calc', False if not
+        present).
+    last_train_hash: string
+        Digest of the dataset on which the calculator was trained last time, as
+        returned by this function in the previous iteration.
+
+    Returns
+    -------
+    calc_amp: 'Amp' object
+        Trained Amp calculator.
+    train_hash: string
+        Digest of train_set, to be passed as last_train_hash in the next
+        iteration.
+
+    Notes
+    -----
+    If the calculator has been loaded from the previous training on the same
+    dataset, training it again is a waste of time and is skipped.
+
+    If 'cache_calc' is True, the parameters of each trained calculator are
+    saved in the AMP_CACHE_DIR directory under the digest of the training
+    dataset. When a calculator is requested for a dataset found in the cache,
+    e.g. after a restart, the cached file is copied to the label of the
+    calculator and loaded instead of training. The cache does not know about
+    the settings in gen_calc_amp, so it must be cleared when they change.
+
+    For parallel version of run_aineb, this function shall be called on the
+    master process only.
+    """
+    if ((iteration == 0 and control_args["restart_with_calc"] is False) or
+       (iteration != 0 and control_args["reuse_calc"] is False)):
+        echo("Initial Amp calculator built from scratch.")
+        reload = False
+    else:
+        echo("Initial Amp calculator loaded from previous training.")
+        reload = True
+    calc_amp = gen_calc_amp(reload=reload)
+    train_hash = hash_images(train_set)
+    cache_calc = control_args.get("cache_calc", False)
+    cache_file = os.path.join(AMP_CACHE_DIR, train_hash+".amp")
+    if reload is True and train_hash == last_train_hash:
+        echo("Training dataset unchanged. Training skipped.")
+    elif cache_calc is True and os.path.exists(cache_file):
+        echo("Amp calculator for the training dataset loaded from cache.")
+        shutil.copyfile(cache_file, calc_amp.label+".amp")
+        calc_amp = gen_calc_amp(reload=True)
+    else:
+        echo("Training the Amp calculator...")
+        if control_args["annealing"] is True:
+            Annealer(calc=calc_amp, images=train_set)
+        calc_amp.train(images=train_set, overwrite=True)
+        if cache_calc is True:
+            os.makedirs(AMP_CACHE_DIR, exist_ok=True)
+            shutil.copyfile(calc_amp.label+".amp", cache_file)
+    return calc_amp, train_hash
+
+
+def open_train_traj(train_file, full_set):
+    """
+    Open train.traj for saving the training dataset incrementally.
+
+    Parameters
+    ----------
+    train_file: string
+        Name of the file from which full_set has been loaded.
+    full_set: list of 'Atoms' objects
+        Training dataset loaded from train_file.
+
+    Returns
+    -------
+    train_traj: 'Trajectory' object
+        Trajectory opened in append mode, to which the new reference images
+        shall be written. It should be closed at the end of the calculation.
+
+    Notes
+    -----
+    If full_set has been loaded from train.traj, under whatever path, it is
+    already on disk and the file is opened for appending directly. Otherwise
+    full_set is written to a temporary file first, which then replaces
+    train.traj, so that an existing train.traj is never left truncated.
+    """
+    if not (os.path.exists("train.traj") and
+            os.path.samefile(train_file, "train.traj")):
+        with Trajectory("train.traj.tmp", "w", master=True) as train_traj:
+            for image in full_set:
+                train_traj.write(image)
+        os.replace("train.traj.tmp", "train.traj")
+    return Trajectory("train.traj", "a", master=True)
@@ -10,14 +10,17 @@ run_aineb:
 
 import sys
 
-from ase.io import read, write
+import numpy as np
 
-from mpi4py import MPI
+from ase.io import write
+from ase.io.trajectory import Trajectory
 
-from amp.utilities import Annealer
+from mpi4py import MPI
 
-from ..common.utilities import echo
-from .common import initialize_mep, validate_mep, cluster_data
+from ..common.utilities import echo, read_traj
+from .common import (initialize_mep, build_images, validate_mep,
+                     check_convergence, cluster_data, train_calc_amp,
+                     open_train_traj)
 
 
 def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
@@ -44,101 +47,146 @@ def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
 
     Amp calculator cannot be passed via MPI and will produce errors like
     "TypeError: cannot serialize '_io.TextIOWrapper'. So we have to train the
-    Amp calculator on parent process, write it to disk and then have all the
-    child processes reload it. In this case, Amp calculators must be trained
-    with 'overwrite=True' argument.
+    Amp calculator on parent process, write it to disk and then broadcast its
+    contents as raw bytes to all the child processes, which reload the
+    calculator from memory. In this case, Amp calculators must be trained with
+    'overwrite=True' argument.
+
+    Only the initial and final images are pickled and sent to the child
+    processes. The positions of the intermediate images are transferred as
+    NumPy arrays via buffer-based Bcast/Gather, and the images are rebuilt
+    from the initial image, so they must share the same atoms, cell and
+    constraints.
+
+    The child processes are spawned once before the main loop, so
+    num_inter_images must not be changed by gen_args during the calculation.
     """
     # Generate the initial controlling arguments
     mep_args, control_args, dataset_args, convergence, neb_args = gen_args()
 
     # Load the initial and final images and training dataset
-    initial_image = read(mep_args["initial_file"], index=-1, parallel=False)
-    final_image = read(mep_args["final_file"], index=-1, parallel=False)
-    full_set = read(dataset_args["train_file"], index=":", parallel=False)
-    train_set = cluster_data(full_set, dataset_args)
+    initial_image = read_traj(mep_args["initial_file"], -1)
+    final_image = read_traj(mep_args["final_file"], -1)
+    full_set = read_traj(dataset_args["train_file"], ":")
+    # The energies and forces of the images are cached in data_stats so that
+    # only the new images are processed in each iteration.
+    data_stats = {}
+    train_set = cluster_data(full_set, dataset_args, data_stats)
+
+    # The training dataset is saved incrementally to train.traj, with only the
+    # new reference images appended in each iteration.
+    train_traj = open_train_traj(dataset_args["train_file"], full_set)
+
+    # Spawn MPI child processes for NEB calculations
+    # The child processes are reused by all the iterations, so that the startup
+    # of the interpreter is paid only once. Spawning is completed before the
+    # Amp calculator starts its worker processes for training, as forking
+    # during an MPI call is unsafe.
+    comm = MPI.COMM_SELF.Spawn(sys.executable, args=["-m", "aipes.neb.child"],
+                               maxprocs=mep_args["num_inter_images"])
 
     # Main loop
     echo("Dynamic AI-NEB running on %d MPI processes." %
          mep_args["num_inter_images"])
     is_converged = False
-    for iteration in range(convergence["max_iteration"]):
-        echo("\nIteration # %d" % (iteration+1))
-
-        # Train the Amp calculator
-        if ((iteration == 0 and control_args["restart_with_calc"] is False) or
-           (iteration != 0 and control_args["reuse_calc"] is False)):
-            echo("Initial Amp calculator built from scratch.")
-            reload = False
-        else:
-            echo("Initial Amp calculator loaded from previous training.")
-            reload = True
-        calc_amp = gen_calc_amp(reload=reload)
-        echo("Training the Amp calculator...")
-        if control_args["annealing"] is True:
-            Annealer(calc=calc_amp, images=train_set)
-        calc_amp.train(images=train_set, overwrite=True)
-        label = calc_amp.label
-
-        # Build the initial MEP
-        if ((iteration == 0 and control_args["restart_with_mep"] is False) or
-           (iteration != 0 and control_args["reuse_mep"] is False)):
-            echo("Initial MEP built from scratch.")
-            mep = initialize_mep(initial_image, final_image,
-                                 mep_args["num_inter_images"], neb_args)
-        else:
-            echo("Initial MEP loaded from mep.traj.")
-            mep = read("mep.traj", index=":", parallel=False)
-
-        # Spawn MPI child processes to calculate the MEP from initial guess
-        echo("Running NEB using the Amp calculator...")
-        comm = MPI.COMM_SELF.Spawn(sys.executable,
-                                   args=["-m", "aipes.neb.child"],
-                                   maxprocs=mep_args["num_inter_images"])
-        comm.bcast(neb_args, root=MPI.ROOT)
-        comm.bcast(mep, root=MPI.ROOT)
-        comm.bcast(label, root=MPI.ROOT)
-        active_image = None
-        mep = comm.gather(active_image, root=MPI.ROOT)
+    last_train_hash = None
+    # The interpolated MEP depends only on the end points and the
+    # interpolation arguments, so it is built once and copied afterwards.
+    mep_cache = {}
+    # The child processes are always terminated, even if an exception is
+    # raised in the main loop, otherwise they would wait for commands
+    # forever.
+    try:
+        for iteration in range(convergence["max_iteration"]):
+            echo("\nIteration # %d" % (iteration+1))
+
+            # Train the Amp calculator
+            calc_amp, last_train_hash = train_calc_amp(gen_calc_amp, train_set,
+                                                       iteration, control_args,
+                                                       last_train_hash)
+            label = calc_amp.label
+
+            # Build the initial MEP
+            if ((iteration == 0 and
+                 control_args["restart_with_mep"] is False) or
+               (iteration != 0 and control_args["reuse_mep"] is False)):
+                echo("Initial MEP built from scratch.")
+                mep = initialize_mep(initial_image, final_image,
+                                     mep_args["num_inter_images"], neb_args,
+                                     mep_cache)
+            elif iteration == 0:
+                echo("Initial MEP loaded from mep.traj.")
+                mep = read_traj("mep.traj", ":")
+            else:
+                # The MEP from the previous iteration is kept in memory, so we
+                # do not need to read it from disk.
+                echo("Initial MEP reused from previous iteration.")
+                mep = last_mep
+
+            # Let the MPI child processes calculate the MEP from initial guess
+            echo("Running NEB using the Amp calculator...")
+            calc_bytes = np.fromfile(label+".amp", dtype=np.uint8)
+            comm.bcast(("neb", (neb_args, mep[0], mep[-1], label,
+                                calc_bytes.size)), root=MPI.ROOT)
+            comm.Bcast([calc_bytes, MPI.BYTE], root=MPI.ROOT)
+            positions = np.array([image.get_positions() for image in mep[1:-1]])
+            comm.Bcast([positions, MPI.DOUBLE], root=MPI.ROOT)
+            comm.Gather(None, [positions, MPI.DOUBLE], root=MPI.ROOT)
+            mep = build_images(initial_image, positions)
+
+            # The validation of MEP is very time-consuming. Here we save MEP
+            # without energies and forces for inspection.
+            mep_chk = [initial_image]
+            mep_chk.extend(mep)
+            mep_chk.append(final_image)
+            write("chk_%d.traj" % (iteration+1), mep_chk, parallel=False)
+            last_mep = mep_chk
+
+            # Validate the MEP against the reference calculator
+            # The reference images are saved to mep_*.traj as they are
+            # produced, so that the energies and forces are kept even if the
+            # validation fails in the middle.
+            echo("Validating the MEP using reference calculator...")
+            reuse_calc_ref = control_args.get("reuse_calc_ref", False)
+            with Trajectory("mep_%d.traj" % (iteration+1), "w",
+                            master=True) as mep_traj:
+                mep_traj.write(initial_image)
+                accuracy, ref_images = validate_mep(mep, calc_amp,
+                                                    gen_calc_ref,
+                                                    traj=mep_traj,
+                                                    reuse_calc_ref=
+                                                    reuse_calc_ref)
+                mep_traj.write(final_image)
+            converged = check_convergence(accuracy, convergence)
+
+            # The reference images are always saved, so that they are available
+            # for restarting even when convergence has been reached.
+            for image in ref_images:
+                train_traj.write(image)
+
+            # Check if convergence has been reached
+            # There is no need to update the training dataset and the
+            # controlling arguments after the last iteration.
+            if converged:
+                is_converged = True
+                break
+
+            # Update training dataset
+            full_set.extend(ref_images)
+            train_set = cluster_data(full_set, dataset_args, data_stats)
+            echo("Size of training dataset after clustering: %d." %
+                 len(train_set))
+
+            # Update controlling arguments
+            (mep_args, control_args, dataset_args,
+             convergence, neb_args) = gen_args(iteration+1, accuracy)
+    finally:
+        train_traj.close()
+
+        # Terminate MPI child processes
+        comm.bcast(("exit", None), root=MPI.ROOT)
         comm.Disconnect()
 
-        # The validation of MEP is very time-consuming. Here we save MEP without
-        # energies and forces for inspection.
-        mep_chk = [initial_image]
-        mep_chk.extend(mep)
-        mep_chk.append(final_image)
-        write("chk_%d.traj" % (iteration+1), mep_chk, parallel=False)
-
-        # Validate the MEP against the reference calculator
-        echo("Validating the MEP using reference calculator...")
-        accuracy, ref_images = validate_mep(mep, calc_amp, gen_calc_ref)
-        converge_status = []
-        for key, value in accuracy.items():
-            echo("%16s = %13.4e (%13.4e)" % (key, value, convergence[key]))
-            converge_status.append(value <= convergence[key])
-
-        # Save the MEP
-        # Note that this piece of code MUST be placed here. Otherwise the
-        # energies in mep.traj will be lost.
-        mep_save = [initial_image]
-        mep_save.extend(ref_images)
-        mep_save.append(final_image)
-        write("mep_%d.traj" % (iteration+1), mep_save, parallel=False)
-
-        # Update training dataset
-        full_set.extend(ref_images)
-        train_set = cluster_data(full_set, dataset_args)
-        echo("Size of training dataset after clustering: %d." % len(train_set))
-        write("train.traj", full_set, parallel=False)
-
-        # Update controlling arguments
-        (mep_args, control_args, dataset_args,
-         convergence, neb_args) = gen_args(iteration+1, accuracy)
-
-        # Check if convergence has been reached
-        if converge_status == [True, True, True, True]:
-            is_converged = True
-            break
-
     # Summary
     if is_converged:
         echo("\nAI-NEB calculation converged."
@@ -8,17 +8,42 @@ run_aineb:
     Performs NEB calculation with first principles corrections.
 """
 
-from ase.io import read, write
-from ase.neb import NEB
-from ase.optimize import BFGS, FIRE
+import time
+from io import StringIO
+
+import numpy as np
+
+from ase.io import write
+from ase.io.trajectory import Trajectory
 
 from mpi4py import MPI
 
 from amp import Amp
-from amp.utilities import Annealer
 
-from ..common.utilities import echo
-from .common import initialize_mep, validate_mep, cluster_data
+from ..common.utilities import echo, read_traj
+from .common import (ACCURACY_KEYS, initialize_mep, build_images, run_neb,
+                     validate_mep, check_convergence, cluster_data,
+                     train_calc_amp, open_train_traj)
+
+
+def _wait_bcast(comm, buf, root=0, interval=1.0):
+    """
+    Broadcast buf from root and wait for completion with sleeping.
+
+    Many MPI implementations busy-wait in blocking collectives, so processes
+    waiting for a long task on root, e.g. training, would keep their cores
+    fully loaded. Here the non-blocking Ibcast is polled every interval
+    seconds instead. Root is the process that has been busy, so it waits for
+    the completion directly without adding any polling latency. Note that
+    Ibcast must be used on root as well, as blocking and non-blocking
+    collectives do not match each other.
+    """
+    request = comm.Ibcast(buf, root=root)
+    if comm.Get_rank() == root:
+        request.Wait()
+        return
+    while not request.Test():
+        time.sleep(interval)
 
 
 def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
@@ -45,9 +70,21 @@ def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
 
     Amp calculator cannot be passed via MPI and will produce errors like
     "TypeError: cannot serialize '_io.TextIOWrapper'. So we have to train the
-    Amp calculator on master process, write it to disk and then have all the
-    processes reload it. In this case, Amp calculators must be trained with
+    Amp calculator on master process, write it to disk and then broadcast its
+    contents as raw bytes to all the processes, which reload the calculator
+    from memory. In this case, Amp calculators must be trained with
     'overwrite=True' argument.
+
+    The initial and final images are broadcast once before the main loop.
+    Afterwards only the positions of the intermediate images are transferred
+    as NumPy arrays, and the images are rebuilt from the initial image, so they
+    must share the same atoms, cell and constraints.
+
+    The reference calculations are distributed over the processes only if
+    control_args["parallel_validation"] is True. In that case gen_calc_ref
+    must make sure that the processes do not share the same working
+    directory, e.g. for VASP, otherwise their input and output files will
+    overwrite each other.
     """
     # Generate the initial controlling arguments
     mep_args, control_args, dataset_args, convergence, neb_args = gen_args()
@@ -60,39 +97,56 @@ def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
 
     # Load the initial and final images and training dataset
     if rank == 0:
-        initial_image = read(mep_args["initial_file"], index=-1, parallel=False)
-        final_image = read(mep_args["final_file"], index=-1, parallel=False)
-        full_set = read(dataset_args["train_file"], index=":", parallel=False)
-        train_set = cluster_data(full_set, dataset_args)
+        initial_image = read_traj(mep_args["initial_file"], -1)
+        final_image = read_traj(mep_args["final_file"], -1)
+        full_set = read_traj(dataset_args["train_file"], ":")
+        # The energies and forces of the images are cached in data_stats so that
+        # only the new images are processed in each iteration.
+        data_stats = {}
+        train_set = cluster_data(full_set, dataset_args, data_stats)
+
+        # The training dataset is saved incrementally to train.traj, with only
+        # the new reference images appended in each iteration.
+        train_traj = open_train_traj(dataset_args["train_file"], full_set)
+    else:
+        initial_image, final_image = None, None
+
+    # The initial and final images are the same for all the iterations, so
+    # they are broadcast only once.
+    initial_image, final_image = comm.bcast((initial_image, final_image),
+                                            root=0)
 
     # Main loop
     echo("Parallel AI-NEB running on %d MPI processes." % size, rank)
     is_converged = False
+    last_train_hash = None
+    # The interpolated MEP depends only on the end points and the
+    # interpolation arguments, so it is built once and copied afterwards.
+    mep_cache = {}
     for iteration in range(convergence["max_iteration"]):
         echo("\nIteration # %d" % (iteration+1), rank)
 
         # Train the Amp calculator
-        # While the master process is training the calculator, we call
-        # comm.bcast() to suspend the other processes.
+        # While the master process is training the calculator, the other
+        # processes are suspended in _wait_bcast().
+        calc_size = np.zeros(1, dtype=np.int64)
         if rank == 0:
-            if ((iteration == 0 and control_args["restart_with_calc"] is False) or
-               (iteration != 0 and control_args["reuse_calc"] is False)):
-                echo("Initial Amp calculator built from scratch.", rank)
-                reload = False
-            else:
-                echo("Initial Amp calculator loaded from previous training.",
-                     rank)
-                reload = True
-            calc_amp = gen_calc_amp(reload=reload)
-            echo("Training the Amp calculator...", rank)
-            if control_args["annealing"] is True:
-                Annealer(calc=calc_amp, images=train_set)
-            calc_amp.train(images=train_set, overwrite=True)
+            calc_amp, last_train_hash = train_calc_amp(gen_calc_amp, train_set,
+                                                       iteration, control_args,
+                                                       last_train_hash)
             label = calc_amp.label
+            calc_bytes = np.fromfile(label+".amp", dtype=np.uint8)
+            calc_size[0] = calc_bytes.size
         else:
             label = None
+        _wait_bcast(comm, [calc_size, MPI.INT64_T])
         label = comm.bcast(label, root=0)
-        calc_amp = Amp.load(label+".amp", cores=1, label=label, logging=False)
+        if rank != 0:
+            calc_bytes = np.empty(calc_size[0], dtype=np.uint8)
+        comm.Bcast([calc_bytes, MPI.BYTE], root=0)
+        calc_text = calc_bytes.tobytes().decode()
+        calc_amp = Amp.load(StringIO(calc_text), cores=1, label=label,
+                            logging=False)
 
         # Build the initial MEP
         if rank == 0:
@@ -100,44 +154,40 @@ def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
                (iteration != 0 and control_args["reuse_mep"] is False)):
                 echo("Initial MEP built from scratch.", rank)
                 mep = initialize_mep(initial_image, final_image,
-                                     mep_args["num_inter_images"], neb_args)
-            else:
+                                     mep_args["num_inter_images"], neb_args,
+                                     mep_cache)
+            elif iteration == 0:
                 echo("Initial MEP loaded from mep.traj.", rank)
-                mep = read("mep.traj", index=":", parallel=False)
+                mep = read_traj("mep.traj", ":")
+            else:
+                # The MEP from the previous iteration is kept in memory, so we
+                # do not need to read it from disk.
+                echo("Initial MEP reused from previous iteration.", rank)
+                mep = last_mep
+            positions = np.array([image.get_positions()
+                                  for image in mep[1:-1]])
         else:
-            mep = None
-        mep = comm.bcast(mep, root=0)
+            positions = np.empty((size, len(initial_image), 3))
+        # Only the positions of the intermediate images are broadcast, and the
+        # images are rebuilt from the initial image on every process.
+        comm.Bcast([positions, MPI.DOUBLE], root=0)
+        mep = [initial_image]
+        mep.extend(build_images(initial_image, positions))
+        mep.append(final_image)
         mep[rank+1].set_calculator(calc_amp)
 
         # Calculate the MEP from initial guess
         echo("Running NEB using the Amp calculator...", rank)
-        assert (len(neb_args["climb"]) ==
-                len(neb_args["opt_algorithm"]) ==
-                len(neb_args["fmax"]) ==
-                len(neb_args["steps"]))
-        for stage in range(len(neb_args["climb"])):
-            if neb_args["climb"][stage] is False:
-                echo("Climbing image switched off.", rank)
-            else:
-                echo("Climbing image switched on.", rank)
-            neb_runner = NEB(mep,
-                             k=neb_args["k"],
-                             climb=neb_args["climb"][stage],
-                             remove_rotation_and_translation=
-                             neb_args["rm_rot_trans"],
-                             method=neb_args["method"],
-                             parallel=True)
-            # NOTE: interpolation is done in initialize_mep.
-            if neb_args["opt_algorithm"][stage] == "FIRE":
-                opt_algorithm = FIRE
-            else:
-                opt_algorithm = BFGS
-            opt_runner = opt_algorithm(neb_runner)
-            opt_runner.run(fmax=neb_args["fmax"][stage],
-                           steps=neb_args["steps"][stage])
-        # Amp calculator cannot be passed by MPI, so we have to gather a copy of
-        # the image.
-        mep = comm.gather(mep[rank+1].copy(), root=0)
+        run_neb(mep, neb_args, parallel=True, rank=rank)
+        # Amp calculator cannot be passed by MPI, so we gather the positions of
+        # the images and rebuild them on the master process.
+        active_positions = np.ascontiguousarray(mep[rank+1].get_positions())
+        comm.Gather([active_positions, MPI.DOUBLE], [positions, MPI.DOUBLE],
+                    root=0)
+        if rank == 0:
+            mep = build_images(initial_image, positions)
+        else:
+            mep = None
 
         # The validation of MEP is very time-consuming. Here we save MEP without
         # energies and forces for inspection.
@@ -146,47 +196,71 @@ def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
             mep_chk.extend(mep)
             mep_chk.append(final_image)
             write("chk_%d.traj" % (iteration+1), mep_chk, parallel=False)
+            last_mep = mep_chk
 
         # Validate the MEP against the reference calculator
+        # The reference images are saved to mep_*.traj by the master process
+        # as soon as they have been collected.
+        # By default the reference calculations are performed on the master
+        # process only. Distributing them over all the processes is switched
+        # on by control_args["parallel_validation"], and requires gen_calc_ref
+        # to give each process its own working directory.
         echo("Validating the MEP using reference calculator...", rank)
         if rank == 0:
-            accuracy, ref_images = validate_mep(mep, calc_amp, gen_calc_ref)
-            converge_status = []
-            for key, value in accuracy.items():
-                echo("%16s = %13.4e (%13.4e)" % (key, value, convergence[key]),
-                     rank)
-                converge_status.append(value <= convergence[key])
+            mep_traj = Trajectory("mep_%d.traj" % (iteration+1), "w",
+                                  master=True)
+            mep_traj.write(initial_image)
         else:
-            accuracy = None
-            converge_status = None
-        accuracy = comm.bcast(accuracy, root=0)
-        converge_status = comm.bcast(converge_status, root=0)
-
-        # Save the MEP
-        # Note that this piece of code MUST be placed here. Otherwise the
-        # energies in mep.traj will be lost.
+            mep_traj = None
+        reuse_calc_ref = control_args.get("reuse_calc_ref", False)
+        if control_args.get("parallel_validation", False) is True:
+            accuracy, ref_images = validate_mep(mep, calc_amp, gen_calc_ref,
+                                                comm, mep_traj, reuse_calc_ref)
+        elif rank == 0:
+            accuracy, ref_images = validate_mep(mep, calc_amp, gen_calc_ref,
+                                                traj=mep_traj,
+                                                reuse_calc_ref=reuse_calc_ref)
+        else:
+            accuracy, ref_images = None, None
+        # The accuracy is broadcast as a fixed-layout array and every process
+        # checks the convergence by itself, since convergence is known to all
+        # the processes.
+        if rank == 0:
+            mep_traj.write(final_image)
+            mep_traj.close()
+            accuracy_array = np.array([accuracy[key] for key in ACCURACY_KEYS])
+        else:
+            accuracy_array = np.empty(len(ACCURACY_KEYS))
+        _wait_bcast(comm, [accuracy_array, MPI.DOUBLE])
+        accuracy = dict(zip(ACCURACY_KEYS, accuracy_array.tolist()))
+        converged = check_convergence(accuracy, convergence, rank)
+
+        # The reference images are always saved, so that they are available
+        # for restarting even when convergence has been reached.
         if rank == 0:
-            mep_save = [initial_image]
-            mep_save.extend(ref_images)
-            mep_save.append(final_image)
-            write("mep_%d.traj" % (iteration+1), mep_save, parallel=False)
+            for image in ref_images:
+                train_traj.write(image)
+
+        # Check if convergence has been reached
+        # There is no need to update the training dataset and the controlling
+        # arguments after the last iteration.
+        if converged:
+            is_converged = True
+            break
 
         # Update training dataset
         if rank == 0:
             full_set.extend(ref_images)
-            train_set = cluster_data(full_set, dataset_args)
+            train_set = cluster_data(full_set, dataset_args, data_stats)
             echo("Size of training dataset after clustering: %d." %
                  len(train_set))
-            write("train.traj", full_set, parallel=False)
 
         # Update controlling arguments
         (mep_args, control_args, dataset_args,
          convergence, neb_args) = gen_args(iteration+1, accuracy)
 
-        # Check if convergence has been reached
-        if converge_status == [True, True, True, True]:
-            is_converged = True
-            break
+    if rank == 0:
+        train_traj.close()
 
     # Summary
     if is_converged:
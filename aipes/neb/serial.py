@@ -8,15 +8,15 @@ run_aineb:
     Performs NEB calculation with first principles corrections.
 """
 
-from ase.io import read, write
-from ase.neb import NEB
-from ase.optimize import BFGS, FIRE
+from ase.io import write
+from ase.io.trajectory import Trajectory
 
 from amp import Amp
-from amp.utilities import Annealer
 
-from ..common.utilities import echo
-from .common import initialize_mep, validate_mep, cluster_data
+from ..calculators.shared import SharedCalculator
+from ..common.utilities import echo, read_traj
+from .common import (initialize_mep, run_neb, validate_mep, check_convergence,
+                     cluster_data, train_calc_amp, open_train_traj)
 
 
 def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
@@ -39,37 +39,41 @@ def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
     CAUTION
     -------
     Amp calculators cannot be shared by more than one NEB images. So we have to
-    train it and then load it from disk for each of the images. In this case,
-    Amp calculators must be trained with 'overwrite=True' argument.
+    train it, load it once and then wrap it with a SharedCalculator for each of
+    the images, which keeps the results of the images apart. The parameters
+    file is read from disk only once and cached in memory. In this case, Amp
+    calculators must be trained with 'overwrite=True' argument.
     """
     # Generate the initial controlling arguments
     mep_args, control_args, dataset_args, convergence, neb_args = gen_args()
 
     # Load the initial and final images and training dataset
-    initial_image = read(mep_args["initial_file"], index=-1, parallel=False)
-    final_image = read(mep_args["final_file"], index=-1, parallel=False)
-    full_set = read(dataset_args["train_file"], index=":", parallel=False)
-    train_set = cluster_data(full_set, dataset_args)
+    initial_image = read_traj(mep_args["initial_file"], -1)
+    final_image = read_traj(mep_args["final_file"], -1)
+    full_set = read_traj(dataset_args["train_file"], ":")
+    # The energies and forces of the images are cached in data_stats so that
+    # only the new images are processed in each iteration.
+    data_stats = {}
+    train_set = cluster_data(full_set, dataset_args, data_stats)
+
+    # The training dataset is saved incrementally to train.traj, with only the
+    # new reference images appended in each iteration.
+    train_traj = open_train_traj(dataset_args["train_file"], full_set)
 
     # Main loop
     echo("Serial AI-NEB running on 1 process.")
     is_converged = False
+    last_train_hash = None
+    # The interpolated MEP depends only on the end points and the
+    # interpolation arguments, so it is built once and copied afterwards.
+    mep_cache = {}
     for iteration in range(convergence["max_iteration"]):
         echo("\nIteration # %d" % (iteration+1))
 
         # Train the Amp calculator
-        if ((iteration == 0 and control_args["restart_with_calc"] is False) or
-           (iteration != 0 and control_args["reuse_calc"] is False)):
-            echo("Initial Amp calculator built from scratch.")
-            reload = False
-        else:
-            echo("Initial Amp calculator loaded from previous training.")
-            reload = True
-        calc_amp = gen_calc_amp(reload=reload)
-        echo("Training the Amp calculator...")
-        if control_args["annealing"] is True:
-            Annealer(calc=calc_amp, images=train_set)
-        calc_amp.train(images=train_set, overwrite=True)
+        calc_amp, last_train_hash = train_calc_amp(gen_calc_amp, train_set,
+                                                   iteration, control_args,
+                                                   last_train_hash)
         label = calc_amp.label
 
         # Build the initial MEP
@@ -77,77 +81,70 @@ def run_aineb(gen_args, gen_calc_amp, gen_calc_ref):
            (iteration != 0 and control_args["reuse_mep"] is False)):
             echo("Initial MEP built from scratch.")
             mep = initialize_mep(initial_image, final_image,
-                                 mep_args["num_inter_images"], neb_args)
-        else:
+                                 mep_args["num_inter_images"], neb_args,
+                                 mep_cache)
+        elif iteration == 0:
             echo("Initial MEP loaded from mep.traj.")
-            mep = read("mep.traj", index=":")
+            mep = read_traj("mep.traj", ":")
+        else:
+            # The MEP from the previous iteration is kept in memory, so we
+            # do not need to read it from disk.
+            echo("Initial MEP reused from previous iteration.")
+            mep = last_mep
+        # The Amp calculator is loaded once and then shared by all the images,
+        # each with its own SharedCalculator.
+        calc_amp = Amp.load(label+".amp", cores=1, label=label, logging=False)
         for image in mep[1:-1]:
-            calc_amp = Amp.load(label + ".amp", cores=1, label=label,
-                                logging=False)
-            image.set_calculator(calc_amp)
+            image.set_calculator(SharedCalculator(calc_amp))
 
         # Calculate the MEP from initial guess
         echo("Running NEB using the Amp calculator...")
-        assert (len(neb_args["climb"]) ==
-                len(neb_args["opt_algorithm"]) ==
-                len(neb_args["fmax"]) ==
-                len(neb_args["steps"]))
-        for stage in range(len(neb_args["climb"])):
-            if neb_args["climb"][stage] is False:
-                echo("Climbing image switched off.")
-            else:
-                echo("Climbing image switched on.")
-            neb_runner = NEB(mep,
-                             k=neb_args["k"],
-                             climb=neb_args["climb"][stage],
-                             remove_rotation_and_translation=
-                             neb_args["rm_rot_trans"],
-                             method=neb_args["method"])
-            # NOTE: interpolation is done in initialize_mep.
-            if neb_args["opt_algorithm"][stage] == "FIRE":
-                opt_algorithm = FIRE
-            else:
-                opt_algorithm = BFGS
-            opt_runner = opt_algorithm(neb_runner)
-            opt_runner.run(fmax=neb_args["fmax"][stage],
-                           steps=neb_args["steps"][stage])
+        run_neb(mep, neb_args)
 
         # The validation of MEP is very time-consuming. Here we save MEP without
         # energies and forces for inspection.
         write("chk_%d.traj" % (iteration+1), mep, parallel=False)
+        last_mep = mep
 
         # Validate the MEP against the reference calculator
         # Note that for serial version of run_aineb we have to pass mep[1:-1]
         # to validate_mep instead of the whole mep.
+        # The reference images are saved to mep_*.traj as they are produced, so
+        # that the energies and forces are kept even if the validation fails
+        # in the middle.
         echo("Validating the MEP using reference calculator...")
-        accuracy, ref_images = validate_mep(mep[1:-1], calc_amp, gen_calc_ref)
-        converge_status = []
-        for key, value in accuracy.items():
-            echo("%16s = %13.4e (%13.4e)" % (key, value, convergence[key]))
-            converge_status.append(value <= convergence[key])
-
-        # Save the MEP
-        # Note that this piece of code MUST be placed here. Otherwise the
-        # energies in mep.traj will be lost.
-        mep_save = [initial_image]
-        mep_save.extend(ref_images)
-        mep_save.append(final_image)
-        write("mep_%d.traj" % (iteration+1), mep_save, parallel=False)
+        reuse_calc_ref = control_args.get("reuse_calc_ref", False)
+        with Trajectory("mep_%d.traj" % (iteration+1), "w",
+                        master=True) as mep_traj:
+            mep_traj.write(initial_image)
+            accuracy, ref_images = validate_mep(mep[1:-1], calc_amp,
+                                                gen_calc_ref, traj=mep_traj,
+                                                reuse_calc_ref=reuse_calc_ref)
+            mep_traj.write(final_image)
+        converged = check_convergence(accuracy, convergence)
+
+        # The reference images are always saved, so that they are available
+        # for restarting even when convergence has been reached.
+        for image in ref_images:
+            train_traj.write(image)
+
+        # Check if convergence has been reached
+        # There is no need to update the training dataset and the controlling
+        # arguments after the last iteration.
+        if converged:
+            is_converged = True
+            break
 
         # Update training dataset
         full_set.extend(ref_images)
-        train_set = cluster_data(full_set, dataset_args)
+        train_set = cluster_data(full_set, dataset_args, data_stats)
         echo("Size of training dataset after clustering: %d." % len(train_set))
-        write("train.traj", full_set, parallel=False)
 
         # Update controlling arguments
         (mep_args, control_args, dataset_args,
          convergence, neb_args) = gen_args(iteration+1, accuracy)
 
-        # Check if convergence has been reached
-        if converge_status == [True, True, True, True]:
-            is_converged = True
-            break
+    train_traj.close()
 
     # Summary
     if is_converged:
@@ -1,8 +1,11 @@
 #! /usr/bin/env python
 """Program for potential energy and forces calculation."""
 
+from multiprocessing import Pool
+
 from ase.io import read, write
 from ase.calculators.emt import EMT
+from ase.calculators.singlepoint import SinglePointCalculator
 from ase.neb import NEB
 
 
@@ -12,6 +15,7 @@ def main():
     initial_file = "initial.traj"
     final_file = "final.traj"
     num_inter_images = 50
+    num_proc = 4
 
     # --------------------------------------------------------------------------
     # Load initial and final images
@@ -22,12 +26,29 @@ def main():
     images = interpolate(initial_image, final_image, num_inter_images)
 
     # Calculate potential energy and forces for each image in images
-    for image in images:
-        print("Dealing with image # %d." % images.index(image), flush=True)
-        image.set_calculator(gen_calc())
-        image.get_potential_energy(apply_constraint=False)
-        image.get_forces(apply_constraint=False)
-        write("static.traj", images)
+    # The images are independent of each other, so they are distributed over
+    # a pool of processes.
+    with Pool(num_proc) as pool:
+        images = pool.map(calc_image, enumerate(images))
+    write("static.traj", images)
+
+
+def calc_image(args):
+    """
+    Calculate the potential energy and forces of an image.
+
+    The calculator is attached within the worker process and the results are
+    returned as a SinglePointCalculator, which can be pickled back to the main
+    process.
+    """
+    index, image = args
+    print("Dealing with image # %d." % index, flush=True)
+    image.set_calculator(gen_calc())
+    energy = image.get_potential_energy(apply_constraint=False)
+    forces = image.get_forces(apply_constraint=False)
+    image.set_calculator(SinglePointCalculator(image, energy=energy,
+                                               forces=forces))
+    return image
 
 
 def gen_calc():
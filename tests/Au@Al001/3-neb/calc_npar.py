@@ -9,12 +9,8 @@ import sys
 
 def calc_size_descriptor(nmax):
     """Calculate the size of Zernike-type descriptor."""
-    count = 0
-    for n in range(nmax+1):
-        for l in range(n+1):
-            if (n-l) % 2 == 0:
-                count += 1
-    return count
+    # For each n there are n//2+1 values of l with 0 <= l <= n and n-l even.
+    return sum(n//2 + 1 for n in range(nmax+1))
 
 
 def calc_num_parameter(nmax, hidden_layers):
@@ -25,6 +25,7 @@ def main():
     num_node_min = 5
     num_node_max = 5
     step = 1
+    num_proc = 1
 
     # --------------------------------------------------------------------------
     # Load and group the data set
@@ -34,10 +35,10 @@ def main():
     # Run cross-validation over num_node
     for num_node in range(num_node_min, num_node_max+step, step):
         hidden_layers = (num_node, num_node)
-        benchmark(gen_calc_amp, hidden_layers, all_data)
+        benchmark(gen_calc_amp, hidden_layers, all_data, num_proc)
 
 
-def gen_calc_amp(hidden_layers):
+def gen_calc_amp(hidden_layers, igroup=None):
     """Returns an Amp calculator."""
     # --------------------------------------------------------------------------
     # Declare controlling parameters
@@ -49,7 +50,16 @@ def gen_calc_amp(hidden_layers):
                    "force_rmse": 0.05,
                    "force_maxresid": 0.1}
     checkpoints = 500
-    label = "amp/train"
+    # The fingerprints of the images are shared by all the groups when they
+    # are trained one after another, so that they are calculated only once
+    # during cross-validation. Groups trained concurrently (num_proc > 1) get
+    # separate files, as they would otherwise write to the same database.
+    if igroup is None:
+        label = "amp/train"
+        dblabel = "amp/train"
+    else:
+        label = "amp/train-%d" % igroup
+        dblabel = "amp/train-%d" % igroup
     cores = 2
     logging = True
 
@@ -66,8 +76,8 @@ def gen_calc_amp(hidden_layers):
                           checkpoints=checkpoints, mode="atom-centered")
 
     # Instantiate the Amp calculator
-    calc = Amp(descriptor=descriptor, model=model, label=label, cores=cores,
-               logging=logging)
+    calc = Amp(descriptor=descriptor, model=model, label=label,
+               dblabel=dblabel, cores=cores, logging=logging)
 
     return calc
 
@@ -1,16 +1,23 @@
 #! /usr/bin/env python
 """Main part of the AINEB program."""
 
-from ase.calculators.emt import EMT
+import os
 
-from amp.descriptor.cutoffs import Cosine
-from amp.descriptor.gaussian import Gaussian
-from amp.regression import Regressor
-from amp.model import LossFunction
-from amp.model.neuralnetwork import NeuralNetwork
-from amp import Amp
+# Amp already runs one worker process per core, so threaded BLAS would
+# oversubscribe the cores. The default must be set before numpy is imported,
+# hence the imports below. A value exported by the user takes precedence.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
 
-from aipes.neb.dynamic import run_aineb
+from ase.calculators.emt import EMT  # noqa: E402
+
+from amp.descriptor.cutoffs import Cosine  # noqa: E402
+from amp.descriptor.gaussian import Gaussian  # noqa: E402
+from amp.regression import Regressor  # noqa: E402
+from amp.model import LossFunction  # noqa: E402
+from amp.model.neuralnetwork import NeuralNetwork  # noqa: E402
+from amp import Amp  # noqa: E402
+
+from aipes.neb.dynamic import run_aineb  # noqa: E402
 
 
 def gen_args(iteration=0, accuracy=None):
@@ -31,7 +38,7 @@ def gen_args(iteration=0, accuracy=None):
         Arguments specifying the initial and final images of the MEP, and the
         number of intermediate images.
     control_args: dictionary
-        Arguments controlling the restart and reuse behaviors.
+        Arguments controlling the restart, reuse and caching behaviors.
     dataset_args: dictionary
         Arguments controlling the training dataset.
     convergence: dictionary
@@ -51,7 +58,10 @@ def gen_args(iteration=0, accuracy=None):
         "restart_with_mep": False,
         "reuse_calc": False,
         "reuse_mep": False,
-        "annealing": True
+        "annealing": True,
+        "cache_calc": False,
+        "parallel_validation": False,
+        "reuse_calc_ref": False
     }
 
     dataset_args = {
@@ -75,12 +85,21 @@ def gen_args(iteration=0, accuracy=None):
         "mic": True,
         "rm_rot_trans": False,
         "climb": [False, True],
+        # Available optimizers: "BFGS", "LBFGS" and "FIRE".
+        # "opt_algorithm": ["LBFGS", "FIRE"],
         "opt_algorithm": ["BFGS", "FIRE"],
         "fmax": [0.5, 0.05],
         "steps": [10, 40],
     }
 
     # Adjust arguments according to iteration number and accuracy
+    # Once the Amp calculator is close to convergence, it can be refined from
+    # the previous training and the NEB calculation can continue from the
+    # previous MEP, instead of starting from scratch.
+    # if (iteration > 0 and
+    #    accuracy["force_maxresid"] <= 1.5 * convergence["force_maxresid"]):
+    #     control_args["reuse_calc"] = True
+    #     control_args["reuse_mep"] = True
     # if iteration > 0 and accuracy["force_maxresid"] <= 0.5:
     #     neb_args["steps"] = [10, 100]
 
@@ -103,6 +122,10 @@ def gen_calc_amp(reload=False):
     }
     checkpoints = 500
     label = "amp/train"
+    # Amp stores the fingerprints in a database named after dblabel, which
+    # defaults to label. It is given explicitly here so that a new and a
+    # reloaded calculator obviously use the same database.
+    dblabel = "amp/train"
     cores = 20
     logging = True
 
@@ -120,10 +143,11 @@ def gen_calc_amp(reload=False):
 
     # Instantiate the Amp calculator
     if reload is False:
-        calc = Amp(descriptor=descriptor, model=model, label=label, cores=cores,
-                   logging=logging)
+        calc = Amp(descriptor=descriptor, model=model, label=label,
+                   dblabel=dblabel, cores=cores, logging=logging)
     else:
-        calc = Amp.load(label+".amp", cores=cores, label=label, logging=logging)
+        calc = Amp.load(label+".amp", cores=cores, label=label,
+                        dblabel=dblabel, logging=logging)
         calc.model.regressor = regressor
         calc.model.lossfunction = lossfunction
     return calc
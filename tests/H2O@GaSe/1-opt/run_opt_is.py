@@ -5,7 +5,7 @@ import os
 
 from ase.io import read
 from aipes.calculators.vasp import VaspFC as Vasp
-from ase.optimize import QuasiNewton
+from ase.optimize import LBFGS, QuasiNewton
 
 
 def main():
@@ -14,6 +14,7 @@ def main():
     image_file = "POSCAR.is"
     fmax = 0.05
     steps = 5000
+    opt_algorithm = "LBFGS"
     traj = "initial.traj"
     log = "initial.log"
 
@@ -21,7 +22,8 @@ def main():
     # Load and optimize the image
     image = read(image_file)
     image.set_calculator(gen_calc())
-    run_opt(image, fmax, steps, traj=traj, log=log)
+    run_opt(image, fmax, steps, traj=traj, log=log,
+            opt_algorithm=opt_algorithm)
 
 
 def gen_calc():
@@ -36,9 +38,20 @@ def gen_calc():
     return calc
 
 
-def run_opt(image, fmax=0.01, steps=1000, traj="opt.traj", log="opt.log"):
-    """Structure optimization using line-search BFGS algorithm."""
-    opt_runner = QuasiNewton(image, trajectory=traj, logfile=log)
+def run_opt(image, fmax=0.01, steps=1000, traj="opt.traj", log="opt.log",
+            opt_algorithm="LBFGS"):
+    """
+    Structure optimization using L-BFGS or line-search BFGS algorithm.
+
+    L-BFGS keeps only the last 20 steps instead of the full Hessian, and runs
+    without line search, which is prone to fail on noisy DFT forces. Set
+    opt_algorithm to "QuasiNewton" for the line-search BFGS algorithm.
+    """
+    if opt_algorithm == "LBFGS":
+        opt_runner = LBFGS(image, trajectory=traj, logfile=log, memory=20,
+                           use_line_search=False)
+    else:
+        opt_runner = QuasiNewton(image, trajectory=traj, logfile=log)
     opt_runner.run(fmax=fmax, steps=steps)
 
 
@@ -35,15 +35,20 @@ def main():
                          interp, mic)
 
     # Run molecular dynamics from each image in images
+    # The trajectory and the VASP calculator are created only once and shared
+    # by all the images.
+    traj = Trajectory("md.traj", mode="w")
+    calc = gen_calc()
     for index, image in enumerate(images):
         t0 = time.strftime("%H:%M:%S")
         print("Dealing with image # %d at %s." % (index, t0), flush=True)
-        image.set_calculator(gen_calc())
-        if index == 0:
-            traj = Trajectory("md.traj", mode="w", atoms=image)
-        else:
-            traj = Trajectory("md.traj", mode="a", atoms=image)
+        image.set_calculator(calc)
         run_md(image, temp, dt, steps, traj)
+        # VASP starts the next image, which is close to this one along the
+        # interpolated path, from the wavefunctions in WAVECAR.
+        if index == 0:
+            calc.set(istart=1)
+    traj.close()
 
 
 def gen_calc():
@@ -69,11 +74,17 @@ def interpolate(initial_image, final_image, num_inter_images, interp, mic):
     return images
 
 
-def run_md(image, temp, dt=1.0, steps=1000, traj="md.traj", log="md.log"):
-    """Constant NVE dynamics using velocity verlet algorithm."""
+def run_md(image, temp, dt=1.0, steps=1000, traj=None, log="md.log"):
+    """
+    Constant NVE dynamics using velocity verlet algorithm.
+
+    If traj is given, it should be an opened trajectory, to which the image is
+    written at each step.
+    """
     MBDist(image, temp=temp*units.kB, force_temp=True)
-    md_runner = VelocityVerlet(image, dt=dt*units.fs, trajectory=traj,
-                               logfile=log)
+    md_runner = VelocityVerlet(image, dt=dt*units.fs, logfile=log)
+    if traj is not None:
+        md_runner.attach(traj.write, interval=1, atoms=image)
     md_runner.run(steps=steps)
 
 
@@ -5,6 +5,7 @@ import os
 import time
 
 from ase.io import read, write
+from ase.io.trajectory import Trajectory
 from aipes.calculators.vasp import VaspFC as Vasp
 from ase.neb import NEB
 
@@ -41,17 +42,26 @@ def main():
             write(str("poscar.i/POSCAR.%03d" % index), image, format="vasp")
 
     # Calculate potential energy and forces for each image in images
+    # Each image is appended to static.traj as soon as it has been calculated,
+    # so that the results are kept even if the calculation stops halfway.
+    # One VASP calculator is shared by all the images.
+    traj = Trajectory("static.traj", mode="w")
+    calc = gen_calc()
     for index, image in enumerate(images):
         t0 = time.strftime("%H:%M:%S")
         print("Dealing with image # %d at %s." % (index, t0), flush=True)
-        image.set_calculator(gen_calc())
+        image.set_calculator(calc)
         image.get_potential_energy(apply_constraint=False)
         image.get_forces(apply_constraint=False)
-        write("static.traj", images)
+        traj.write(image)
         if index == 0:
             os.rename("OUTCAR", "OUTCAR.is")
+            # VASP starts the next images, which are close to the previous ones
+            # along the interpolated path, from the wavefunctions in WAVECAR.
+            calc.set(istart=1)
         elif index == len(images) - 1:
             os.rename("OUTCAR", "OUTCAR.fs")
+    traj.close()
 
 
 def gen_calc():
@@ -10,6 +10,4 @@ from ase.io import read
 images = read(sys.argv[1], index=':')
 for image in images:
     forces = image.get_forces(apply_constraint=False)
-    forces_mod = [np.sqrt(np.sum(v**2)) for v in forces]
-    forces_mod = np.array(forces_mod)
-    print(np.max(forces_mod))
+    print(np.linalg.norm(forces, axis=1).max())